@@ -309,8 +309,13 @@ def _load_handoff_map() -> dict[str, str]:
 
 def save_handoff_session(alias: str, session_id: str) -> None:
     """Persist a handoff alias → session_id mapping."""
+    save_handoff_sessions({alias: session_id})
+
+
+def save_handoff_sessions(mapping: dict[str, str]) -> None:
+    """Persist several handoff alias → session_id mappings in one write."""
     data = _load_handoff_map()
-    data[alias] = session_id
+    data.update(mapping)
     # Trim oldest entries to keep the file bounded
     if len(data) > _HANDOFF_MAP_MAX:
         keys = list(data.keys())
@@ -2,22 +2,32 @@
 
 import asyncio
 import itertools
-from collections import deque
-from unittest.mock import AsyncMock, MagicMock, patch
+import re
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock, Mock, call, patch
 
 import pytest
 
 from chicane.config import Config
 from chicane.claude import ClaudeEvent
-from chicane.sessions import SessionStore
+from chicane.handlers import _process_message as _process_message_impl
+from chicane.sessions import SessionInfo, SessionStore
 from chicane.slack_queue import SlackMessageQueue
 
 # Auto-incrementing counter for unique tool_use IDs in tests.
 _tool_id_counter = itertools.count(1)
 
+# Matches the auto-continue notice posted after an empty response.
+_CONTINUE_ATTEMPT_RE = re.compile(r"sending `continue`.*attempt (\d+)/(\d+)", re.S)
 
-@pytest.fixture
+
+@pytest.fixture(scope="session")
 def config():
+    # Shared for the whole session.  Config is frozen, but its list and dict
+    # fields are not: tests must not mutate them (use dataclasses.replace).
     return Config(
         slack_bot_token="xoxb-test",
         slack_app_token="xapp-test",
@@ -26,7 +36,7 @@ def config():
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def config_restricted():
     return Config(
         slack_bot_token="xoxb-test",
@@ -46,6 +56,86 @@ def queue():
     return SlackMessageQueue(min_interval=0.0)
 
 
+@pytest.fixture(scope="session")
+def process_message():
+    """``chicane.handlers._process_message``, imported once with conftest."""
+    return _process_message_impl
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+@dataclass(slots=True)
+class FakeSession:
+    """Lightweight ClaudeSession stand-in for ``_process_message`` tests.
+
+    ``_process_message`` only reads ``stream`` and ``session_id``, awaits
+    ``run`` / ``disconnect`` / ``interrupt`` and checks the interrupt state,
+    so a slotted dataclass avoids building a ``MagicMock`` for every test.
+    The awaited methods default to a plain no-op coroutine; tests that
+    assert on one swap in an ``AsyncMock`` themselves.
+    """
+
+    stream: Any
+    session_id: str = "s1"
+    run: Any = _noop
+    disconnect: Any = _noop
+    interrupt: Any = _noop
+    was_interrupted: bool = False
+    is_streaming: bool = False
+    interrupt_source: str | None = None
+    _ask_user_callback: Any = None
+
+
+@pytest.fixture(scope="session")
+def session_factory():
+    """Factory for ``FakeSession`` instances: ``session_factory(stream, id)``."""
+    return FakeSession
+
+
+@pytest.fixture
+def patched_create(sessions, monkeypatch):
+    """Replace ``sessions.get_or_create`` with a ``Mock`` for the whole test.
+
+    Tests set ``patched_create.return_value`` and read
+    ``patched_create.call_args`` instead of entering their own
+    ``patch.object`` context.
+    """
+    mock_create = Mock()
+    monkeypatch.setattr(sessions, "get_or_create", mock_create)
+    return mock_create
+
+
+@pytest.fixture
+def run_message(process_message, client, config, sessions, queue, patched_create):
+    """Send one message through ``_process_message`` for a scripted session.
+
+    ``await run_message(session, prompt)`` wraps ``session`` with
+    :func:`mock_session_info`, serves it from ``patched_create`` and posts a
+    top-level channel message unless ``event`` is given.  Extra keyword
+    arguments are set on the ``SessionInfo`` first (unknown names raise
+    ``AttributeError``); it is returned so tests can inspect what the
+    handler left on it.
+    """
+
+    async def _run(session, prompt="hello", *, event=None, config=config, **info_attrs):
+        info = mock_session_info(session)
+        for name, value in info_attrs.items():
+            # SessionInfo has no slots, so a misspelled name would otherwise
+            # be set silently and the test would run with the default.
+            if not hasattr(info, name):
+                raise AttributeError(f"SessionInfo has no attribute {name!r}")
+            setattr(info, name, value)
+        patched_create.return_value = info
+        if event is None:
+            event = {"ts": "5000.0", "channel": "C_CHAN", "user": "UHUMAN1"}
+        await process_message(event, prompt, client, config, sessions, queue)
+        return info
+
+    return _run
+
+
 def make_event(type: str, text: str = "", **kwargs) -> ClaudeEvent:
     """Helper to create ClaudeEvent instances."""
     if type == "assistant":
@@ -84,8 +174,25 @@ def tool_block(name: str, id: str | None = None, **inputs) -> dict:
     }
 
 
-def mock_client():
-    client = AsyncMock()
+# Slack Web API methods the handlers call; this tuple defines FakeSlackClient's surface.
+SLACK_CLIENT_METHODS = (
+    "auth_test",
+    "chat_postMessage",
+    "chat_update",
+    "conversations_history",
+    "conversations_info",
+    "conversations_list",
+    "conversations_replies",
+    "files_completeUploadExternal",
+    "files_getUploadURLExternal",
+    "files_upload_v2",
+    "reactions_add",
+    "reactions_get",
+    "reactions_remove",
+)
+
+
+def _apply_client_defaults(client):
     client.chat_postMessage.return_value = {"ts": "9999.0"}
     client.conversations_info.return_value = {"channel": {"name": "general"}}
     # conversations_replies / conversations_history used by reconnect scanning.
@@ -102,9 +209,137 @@ def mock_client():
         "file_id": "F_FAKE",
     }
     client.files_completeUploadExternal.return_value = {"ok": True}
+
+
+def mock_client():
+    client = AsyncMock()
+    _apply_client_defaults(client)
     return client
 
 
+def reset_client(client):
+    """Clear recorded calls, return values and side effects on a shared
+    client and restore the default Slack responses."""
+    client.reset_mock(return_value=True, side_effect=True)
+    _apply_client_defaults(client)
+
+
+def _is_exception(obj):
+    return isinstance(obj, BaseException) or (
+        isinstance(obj, type) and issubclass(obj, BaseException)
+    )
+
+
+class CallRecorder:
+    """Awaitable stand-in for a single ``AsyncMock`` Slack method.
+
+    Records every call in ``call_args_list`` and returns an already-resolved
+    future.  ``side_effect`` may be an exception (class or instance), which
+    is raised, or a callable, whose result is returned; otherwise calls
+    return ``return_value``.
+    """
+
+    __slots__ = ("call_args_list", "return_value", "side_effect")
+
+    def __init__(self, return_value=None):
+        self.call_args_list = []
+        self.return_value = return_value
+        self.side_effect = None
+
+    def __call__(self, *args, **kwargs):
+        self.call_args_list.append(call(*args, **kwargs))
+        future = asyncio.get_running_loop().create_future()
+        effect = self.side_effect
+        if effect is None:
+            future.set_result(self.return_value)
+        elif _is_exception(effect):
+            future.set_exception(effect)
+        else:
+            try:
+                future.set_result(effect(*args, **kwargs))
+            except Exception as exc:
+                future.set_exception(exc)
+        return future
+
+    @property
+    def call_args(self):
+        return self.call_args_list[-1] if self.call_args_list else None
+
+    @property
+    def called(self):
+        return bool(self.call_args_list)
+
+    def assert_called(self):
+        assert self.call_args_list, "Expected call not made."
+
+    def assert_not_called(self):
+        assert not self.call_args_list, (
+            f"Expected no calls, got {len(self.call_args_list)}."
+        )
+
+    def reset_mock(self, return_value=False, side_effect=False):
+        self.call_args_list.clear()
+        if return_value:
+            self.return_value = None
+        if side_effect:
+            self.side_effect = None
+
+
+class FakeSlackClient:
+    """Lightweight Slack client double for ``_process_message`` tests.
+
+    Exposes only the Web API methods the handlers call, each as a
+    ``CallRecorder``, so it is much cheaper to build and call than the
+    ``AsyncMock`` returned by ``mock_client()``.
+    """
+
+    METHODS = SLACK_CLIENT_METHODS
+
+    def __init__(self):
+        for name in self.METHODS:
+            setattr(self, name, CallRecorder())
+        _apply_client_defaults(self)
+
+    def reset_mock(self, return_value=False, side_effect=False):
+        for name in self.METHODS:
+            getattr(self, name).reset_mock(return_value, side_effect)
+
+
+@pytest.fixture(scope="session")
+def _slack_client():
+    return FakeSlackClient()
+
+
+@pytest.fixture
+def client(_slack_client):
+    """The shared ``FakeSlackClient``, cleared with ``reset_client`` for each test."""
+    reset_client(_slack_client)
+    return _slack_client
+
+
+def posted_texts(client):
+    """Lazily yield the ``text`` of each ``chat_postMessage`` call."""
+    for c in client.chat_postMessage.call_args_list:
+        yield c.kwargs.get("text") or ""
+
+
+def find_one(client, substr):
+    """Assert exactly one ``chat_postMessage`` text contains ``substr`` and return it."""
+    hits = [text for text in posted_texts(client) if substr in text]
+    assert len(hits) == 1, hits
+    return hits[0]
+
+
+def find_continue_posts(client):
+    """Return ``(attempt, max_attempts)`` for every auto-continue notice posted."""
+    found = []
+    for text in posted_texts(client):
+        m = _CONTINUE_ATTEMPT_RE.search(text)
+        if m:
+            found.append((int(m.group(1)), int(m.group(2))))
+    return found
+
+
 def make_user_event_with_results(results: list[dict]) -> ClaudeEvent:
     """Create a user event with tool_result blocks."""
     return ClaudeEvent(
@@ -117,37 +352,28 @@ def make_user_event_with_results(results: list[dict]) -> ClaudeEvent:
 
 
 def mock_session_info(mock_session, thread_ts="1000.0"):
-    """Wrap a mock ClaudeSession in a mock SessionInfo with a real asyncio.Lock.
+    """Wrap a mock ClaudeSession in a real ``SessionInfo``.
 
     Since ``SessionStore.get_or_create`` now returns a ``SessionInfo`` object
     (with ``.session`` and ``.lock``), all handler tests that patch
-    ``get_or_create`` need to return this wrapper.
-
-    Also configures the mock session with sensible defaults for the interrupt
-    mechanism so tests don't fail on the ``was_interrupted`` / ``is_streaming``
-    checks introduced by the concurrency control.
+    ``get_or_create`` need to return this wrapper.  Using the real dataclass
+    rather than a ``MagicMock`` keeps construction cheap and makes a typo'd
+    attribute fail loudly instead of returning a child mock.
+
+    Also configures a ``MagicMock`` session with sensible defaults for the
+    interrupt mechanism so tests don't fail on the ``was_interrupted`` /
+    ``is_streaming`` checks introduced by the concurrency control.  A
+    ``FakeSession`` already carries those defaults and is left as is.
     """
+    if isinstance(mock_session, FakeSession):
+        return SessionInfo(session=mock_session, thread_ts=thread_ts, cwd=Path("."))
     mock_session.was_interrupted = False
     mock_session.is_streaming = False
     mock_session.interrupt_source = None
     mock_session.interrupt = AsyncMock()
     mock_session.disconnect = AsyncMock()
     mock_session._ask_user_callback = None
-    info = MagicMock()
-    info.session = mock_session
-    info.lock = asyncio.Lock()
-    info.thread_ts = thread_ts
-    info.thread_reactions = set()
-    info.session_alias = None
-    info.total_requests = 0
-    info.total_turns = 0
-    info.total_cost_usd = 0.0
-    info.total_commits = 0
-    info.empty_continue_count = 0
-    info.todo_snapshot = None
-    info.pending_messages = deque()
-    info.pending_question = None
-    return info
+    return SessionInfo(session=mock_session, thread_ts=thread_ts, cwd=Path("."))
 
 
 def _make_fake_http_session():
@@ -183,11 +409,20 @@ def _patch_snippet_io():
         yield
 
 
+@pytest.fixture(scope="session")
+def _handoff_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("handoff")
+
+
 @pytest.fixture(autouse=True)
-def _isolate_handoff_map(tmp_path):
-    """Redirect handoff_sessions.json to a temp dir so tests never pollute the real file."""
-    with patch("chicane.config._HANDOFF_MAP_FILE", tmp_path / "handoff_sessions.json"):
-        yield
+def _isolate_handoff_map(_handoff_dir, monkeypatch):
+    """Redirect handoff_sessions.json to a temp dir so tests never pollute the real file.
+
+    Each test gets its own uniquely named map file inside one shared
+    directory, which avoids creating a ``tmp_path`` tree per test.
+    """
+    map_file = _handoff_dir / f"handoff_sessions-{uuid.uuid4().hex}.json"
+    monkeypatch.setattr("chicane.config._HANDOFF_MAP_FILE", map_file)
 
 
 def capture_app_handlers(mock_app):
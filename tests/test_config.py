@@ -531,3 +531,27 @@ class TestHandoffFilePermissions:
 
         assert map_file.exists()
         assert map_file.stat().st_mode & 0o777 == 0o600
+
+
+class TestSaveHandoffSessions:
+    def test_saves_all_mappings_in_one_write(self, tmp_path, monkeypatch):
+        from chicane.config import load_handoff_session, save_handoff_sessions
+        map_file = tmp_path / "handoff_sessions.json"
+        monkeypatch.setattr("chicane.config._HANDOFF_MAP_FILE", map_file)
+        save_handoff_session("old-alias", "old-id")
+
+        save_handoff_sessions({"first-alias": "first-id", "second-alias": "second-id"})
+
+        assert load_handoff_session("old-alias") == "old-id"
+        assert load_handoff_session("first-alias") == "first-id"
+        assert load_handoff_session("second-alias") == "second-id"
+
+    def test_trims_oldest_entries(self, tmp_path, monkeypatch):
+        from chicane.config import _HANDOFF_MAP_MAX, load_handoff_session, save_handoff_sessions
+        map_file = tmp_path / "handoff_sessions.json"
+        monkeypatch.setattr("chicane.config._HANDOFF_MAP_FILE", map_file)
+
+        save_handoff_sessions({f"alias-{i}": f"id-{i}" for i in range(_HANDOFF_MAP_MAX + 5)})
+
+        assert load_handoff_session("alias-0") is None
+        assert load_handoff_session(f"alias-{_HANDOFF_MAP_MAX + 4}") == f"id-{_HANDOFF_MAP_MAX + 4}"